@@ -1,17 +1,21 @@
 # disk-status-exporter/main.py
 
 import asyncio
-import glob
+import json
 import logging
 import os
 import re
 import shutil
 import subprocess
 import time
-from collections.abc import Iterable
-from contextlib import asynccontextmanager
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, suppress
+from dataclasses import dataclass
 
 from fastapi import FastAPI, Response
+from fastapi.responses import StreamingResponse
 
 PROBE_ATTEMPTS = max(int(os.getenv("PROBE_ATTEMPTS", "1")), 1)
 PROBE_INTERVAL_MS = max(int(os.getenv("PROBE_INTERVAL_MS", "1000")), 0)
@@ -32,39 +36,85 @@ SMARTCTL_PATH = shutil.which("smartctl")
 if SMARTCTL_PATH is None:
     logger.warning("smartctl binary not found in PATH; probes may fail if not installed")
 
-# Cooldown tracking for devices that timeout
-_device_cooldowns: dict[str, float] = {}
+# Resolved once; the container's tool set doesn't change at runtime
+ZPOOL_PATH = shutil.which("zpool")
+
+# Probe backend: "smartctl" (default) or "hdparm" (`hdparm -C`, one CHECK POWER MODE command)
+POWER_PROBE = os.getenv("POWER_PROBE", "smartctl").strip().lower()
+HDPARM_PATH = shutil.which("hdparm")
+if POWER_PROBE == "hdparm" and HDPARM_PATH is None:
+    logger.warning("POWER_PROBE=hdparm but hdparm not found in PATH; falling back to smartctl")
+
+# Cooldown tracking for devices that timeout, oldest first. Entries expire lazily on
+# lookup; the size cap bounds memory if device names churn (hot-swap, failing disks).
+_device_cooldowns: OrderedDict[str, float] = OrderedDict()
+_MAX_COOLDOWNS = 4096
 COOLDOWN_SECONDS = int(os.getenv("COOLDOWN_SECONDS", "300"))  # 5 minutes default
 
 
 def is_device_in_cooldown(dev: str) -> bool:
     """Check if device should be skipped due to recent timeout."""
-    if dev in _device_cooldowns:
-        if time.time() < _device_cooldowns[dev]:
-            return True
-        del _device_cooldowns[dev]
+    until = _device_cooldowns.get(dev)
+    if until is None:
+        return False
+    if time.time() < until:
+        return True
+    _device_cooldowns.pop(dev, None)
     return False
 
 
 def set_device_cooldown(dev: str):
     """Mark device for cooldown after timeout."""
     _device_cooldowns[dev] = time.time() + COOLDOWN_SECONDS
+    _device_cooldowns.move_to_end(dev)
+    while len(_device_cooldowns) > _MAX_COOLDOWNS:
+        _device_cooldowns.popitem(last=False)
     logger.warning("device=%s entering cooldown for %ds after timeout", dev, COOLDOWN_SECONDS)
 
 
+# Recent power-state results, so frequent scrapes don't issue a SMART command every time.
+# dev -> (time.monotonic() of the probe, state). Only touched from the event loop.
+_smart_cache: dict[str, tuple[float, str]] = {}
+_smart_cache_hits = 0
+SMART_CACHE_SECONDS = max(float(os.getenv("SMART_CACHE_SECONDS", "30")), 0.0)
+
+# Rendered /metrics body shared by scrapes inside METRICS_CACHE_SECONDS (0 = off, stream)
+_metrics_cache: tuple[float, bytes] | None = None
+_metrics_cache_lock = asyncio.Lock()
+METRICS_CACHE_SECONDS = max(float(os.getenv("METRICS_CACHE_SECONDS", "0")), 0.0)
+
+# Latest zpool map published by the background refresher; None until the first refresh.
+_pool_map: dict[str, str] | None = None
+POOL_REFRESH_SECONDS = max(float(os.getenv("POOL_REFRESH_SECONDS", "60")), 1.0)
+
+# Shared across scrapes so overlapping requests can't exceed MAX_CONCURRENCY smartctl processes
+_probe_semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+# Dedicated workers sized to the semaphore, so probes never queue behind (or crowd out)
+# other users of the loop's default executor.
+_probe_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY, thread_name_prefix="probe")
+
+
 # ---- Lifespan (replaces deprecated on_event startup) ----
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("disk-status-exporter starting (version=%s)", os.getenv("VERSION", "unknown"))
     logger.info(
         "probe settings: PROBE_ATTEMPTS=%d PROBE_INTERVAL_MS=%d"
-        " MAX_CONCURRENCY=%d COOLDOWN_SECONDS=%d",
+        " MAX_CONCURRENCY=%d COOLDOWN_SECONDS=%d SMART_CACHE_SECONDS=%g"
+        " METRICS_CACHE_SECONDS=%g POWER_PROBE=%s",
         PROBE_ATTEMPTS,
         PROBE_INTERVAL_MS,
         MAX_CONCURRENCY,
         COOLDOWN_SECONDS,
+        SMART_CACHE_SECONDS,
+        METRICS_CACHE_SECONDS,
+        POWER_PROBE,
     )
+    refresher = asyncio.create_task(refresh_pool_map_forever())
     yield
+    refresher.cancel()
+    with suppress(asyncio.CancelledError):
+        await refresher
 
 
 app = FastAPI(lifespan=lifespan)
@@ -97,9 +147,57 @@ ACTIVITY_RANK: dict[str, int] = {
     "active": 8,
 }
 
+# smartctl power-mode tokens, highest precedence first. Longer tokens precede their
+# prefixes ("IDLE_A" before "IDLE") so the alternation below matches them whole.
+SMART_STATE_PRECEDENCE: tuple[tuple[str, str], ...] = (
+    ("STANDBY", "standby"),
+    ("SLEEP", "sleep"),
+    ("IDLE_A", "idle_a"),
+    ("IDLE_B", "idle_b"),
+    ("IDLE_C", "idle_c"),
+    ("ACTIVE OR IDLE", "active_or_idle"),
+    ("ACTIVE/IDLE", "active_or_idle"),
+    ("ACTIVE", "active"),
+    ("IDLE", "idle"),
+)
+# Probe output is matched as raw bytes; only the few matched tokens are decoded
+_SMART_STATE_RE = re.compile(
+    b"|".join(re.escape(token.encode()) for token, _ in SMART_STATE_PRECEDENCE), re.IGNORECASE
+)
+_SMART_UNAVAILABLE_RE = re.compile(rb"SMART support is:\s+Unavailable", re.IGNORECASE)
+_DIGITS = "0123456789"
+# `zpool status` lines that matter: "pool: <name>", "config:", and vdev device paths
+_ZPOOL_STATUS_RE = re.compile(
+    r"^[ \t]*(?:pool:[ \t]*(?P<pool>\S+)|config:|(?P<dev>/dev/\S+))", re.MULTILINE
+)
+
+SYS_BLOCK_DIR = "/sys/block"
+# Loop/ram/fd/optical, device-mapper, mdraid, and zvols are never physical HDDs
+BLOCK_SKIP_PREFIXES = ("loop", "ram", "fd", "sr", "md", "zd", "dm-")
+BY_ID_DIR = "/dev/disk/by-id"
+ZFS_KSTAT_DIR = "/proc/spl/kstat/zfs"
 PREFERRED_ID_PREFIX = ("ata-", "scsi-", "wwn-", "nvme-", "usb-", "virtio-")
 
 
+# Prometheus text format: backslash, double quote and newline must be escaped in label values
+_PROM_LABEL_ESCAPES = str.maketrans({"\\": "\\\\", '"': '\\"', "\n": "\\n"})
+
+
+def prom_escape_label_value(s: str | None) -> str:
+    """Escape a label value for the Prometheus text exposition format."""
+    return "" if s is None else s.translate(_PROM_LABEL_ESCAPES)
+
+
+@dataclass(slots=True)
+class DiskInfo:
+    """An HDD selected for probing, with its resolved metric labels."""
+
+    dev: str
+    device_id: str
+    dtype: str
+    pool: str
+
+
 def highest_activity_state(a: str, b: str) -> str:
     """Return the state with higher activity according to ACTIVITY_RANK."""
     return a if ACTIVITY_RANK.get(a, 0) >= ACTIVITY_RANK.get(b, 0) else b
@@ -108,156 +206,376 @@ def highest_activity_state(a: str, b: str) -> str:
 def list_block_devices() -> Iterable[str]:
     """
     Enumerate block devices by kname via /sys/block, skipping virtual devices.
-    Returns iterable of /dev/<kname> paths.
+    Returns iterable of /dev/<kname> paths that exist here; in a container
+    sysfs lists every host disk but /dev only holds the passed-through nodes.
     """
-    sys_block = "/sys/block"
-    if not os.path.isdir(sys_block):
-        return []
+    try:
+        with os.scandir(SYS_BLOCK_DIR) as it:
+            knames = [entry.name for entry in it if not entry.name.startswith(BLOCK_SKIP_PREFIXES)]
+    except OSError:
+        return
 
-    for kname in os.listdir(sys_block):
-        # Skip loop/ram/fd/optical, device-mapper, mdraid, and zvols
-        if kname.startswith(("loop", "ram", "fd", "sr", "md", "zd")) or kname.startswith(("dm-",)):
-            continue
-        # Example kname: sda, sdb, nvme0n1, vda, etc.
+    # Example kname: sda, sdb, nvme0n1, vda, etc.
+    for kname in knames:
         dev = f"/dev/{kname}"
-        if os.path.exists(dev):
+        if os.access(dev, os.F_OK):
             yield dev
 
 
+def _read_sysfs(path: str) -> str:
+    """
+    Read a small sysfs attribute with a single os.read, skipping the buffered
+    text-file stack that open() builds. Returns "" if it can't be read.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return ""
+    try:
+        return os.read(fd, 256).decode(errors="replace").strip()
+    except OSError:
+        return ""
+    finally:
+        os.close(fd)
+
+
+# kname -> "hdd"/"ssd". The rotational flag is fixed for a device's lifetime;
+# enumerate_disks drops entries for knames that disappear so a reused name is re-read.
+_rotational_cache: dict[str, str] = {}
+
+
 def get_rotational_type(dev: str) -> str:
     """
     Return 'hdd' if rotational==1, 'ssd' if 0, else 'unknown'.
+    Known results are cached per kname; 'unknown' is retried on the next call.
     """
     kname = os.path.basename(dev)
-    path = f"/sys/block/{kname}/queue/rotational"
-    try:
-        with open(path) as f:
-            return "hdd" if f.read().strip() == "1" else "ssd"
-    except Exception:
+    dtype = _rotational_cache.get(kname)
+    if dtype is not None:
+        return dtype
+    value = _read_sysfs(f"{SYS_BLOCK_DIR}/{kname}/queue/rotational")
+    if not value:
         return "unknown"
+    dtype = _rotational_cache[kname] = "hdd" if value == "1" else "ssd"
+    return dtype
+
+
+def _prefix_rank(name: str) -> int:
+    """Position of name's prefix in PREFERRED_ID_PREFIX; unlisted prefixes rank last."""
+    for i, prefix in enumerate(PREFERRED_ID_PREFIX):
+        if name.startswith(prefix):
+            return i
+    return len(PREFERRED_ID_PREFIX)
+
+
+def _id_preference(name: str) -> tuple[int, int, str]:
+    """Sort key for by-id names: prefix priority, then shorter, then alphabetical."""
+    return (_prefix_rank(name), len(name), name)
+
+
+def read_by_id_links() -> dict[str, str]:
+    """
+    Map each /dev/disk/by-id link name to the device path it points at, e.g.
+    {"ata-ST16000...-part1": "/dev/sda1"}, using one readlink per entry rather
+    than a realpath component walk.
+    """
+    links: dict[str, str] = {}
+    try:
+        with os.scandir(BY_ID_DIR) as it:
+            for entry in it:
+                # d_type from readdir; skips a failing readlink() on stray non-links
+                if not entry.is_symlink():
+                    continue
+                try:
+                    target = os.readlink(entry.path)
+                except OSError:
+                    continue
+                links[entry.name] = os.path.normpath(os.path.join(BY_ID_DIR, target))
+    except OSError:
+        return {}
+    return links
 
 
-def is_rotational(dev: str) -> bool:
-    return get_rotational_type(dev) == "hdd"
+def build_by_id_index() -> dict[str, list[str]]:
+    """
+    Map each resolved device path to the /dev/disk/by-id names that point at it,
+    most preferred first, e.g. {"/dev/sda": ["ata-ST16000...", "wwn-0x5000..."]}.
+    Built once per scrape so per-device lookups are a plain dict access.
+    """
+    index: dict[str, list[str]] = {}
+    for name, target in read_by_id_links().items():
+        index.setdefault(target, []).append(name)
+
+    # Prefer human-friendly, stable prefixes, in PREFERRED_ID_PREFIX order
+    for names in index.values():
+        names.sort(key=_id_preference)
+    return index
 
 
-def get_persistent_id(dev: str) -> str:
+def get_persistent_id(dev: str, by_id_index: dict[str, list[str]] | None = None) -> str:
     """
     Return a stable /dev/disk/by-id/<id> symlink (preferred prefixes first).
     Fall back to the raw /dev/<kname> if no by-id link exists.
+    Pass the scrape's build_by_id_index() result to avoid rebuilding it per device.
     """
-    by_id_dir = "/dev/disk/by-id"
-    if not os.path.isdir(by_id_dir):
-        return dev
-
-    real = os.path.realpath(dev)
-    candidates = []
-    for path in glob.glob(os.path.join(by_id_dir, "*")):
-        try:
-            if os.path.realpath(path) == real:
-                candidates.append(os.path.basename(path))
-        except Exception:
-            continue
+    if by_id_index is None:
+        by_id_index = build_by_id_index()
 
+    candidates = by_id_index.get(os.path.realpath(dev))
     if not candidates:
         return dev
-
-    # Prefer human-friendly, stable prefixes
-    candidates.sort(key=lambda n: (0 if n.startswith(PREFERRED_ID_PREFIX) else 1, len(n), n))
-    return f"/dev/disk/by-id/{candidates[0]}"
+    return f"{BY_ID_DIR}/{candidates[0]}"
 
 
-def is_virtual_device(dev: str) -> bool:
+def is_virtual_device(
+    dev: str,
+    by_id_index: dict[str, list[str]] | None = None,
+    device_id: str | None = None,
+) -> bool:
     """
     Heuristics to filter out QEMU/virtual devices:
     - /sys/block/<kname>/device/{vendor,model} contains QEMU or VIRTUAL
     - device_id starts with scsi-0QEMU_, ata-QEMU_, or virtio-
+    Pass device_id when the caller has already resolved it.
     """
-    kname = os.path.basename(dev)
-    vendor_path = f"/sys/block/{kname}/device/vendor"
-    model_path = f"/sys/block/{kname}/device/model"
+    device_dir = f"{SYS_BLOCK_DIR}/{os.path.basename(dev)}/device"
+    # Some block devices (e.g. NVMe namespaces) have no vendor/model attributes here,
+    # or no device/ directory at all; one stat saves two failed opens.
+    if os.path.isdir(device_dir):
+        for attr in ("vendor", "model"):
+            value = _read_sysfs(f"{device_dir}/{attr}").upper()
+            if "QEMU" in value or "VIRTUAL" in value:
+                return True
+
+    if device_id is None:
+        device_id = get_persistent_id(dev, by_id_index)
+    base_id = os.path.basename(device_id)
+    return base_id.startswith(("scsi-0QEMU_", "ata-QEMU_", "virtio-"))
 
-    vend = ""
-    model = ""
-    try:
-        with open(vendor_path) as f:
-            vend = f.read().strip().upper()
-    except Exception:
-        pass
+
+def _strip_partition(path: str) -> str:
+    """
+    Return the whole-disk path for a partition path:
+    /dev/sdd1 -> /dev/sdd, /dev/nvme0n1p2 -> /dev/nvme0n1,
+    /dev/disk/by-id/ata-X-part1 -> /dev/disk/by-id/ata-X.
+    Whole-disk paths (including /dev/nvme0n1) come back unchanged.
+    """
+    # i is where the trailing digit run starts; one C-level scan, no regex
+    i = len(path.rstrip(_DIGITS))
+    if i == len(path):
+        return path
+    if path.endswith("-part", 0, i):
+        return path[: i - len("-part")]
+    if path.startswith("/dev/disk/by-id/"):
+        # A whole-disk link whose name happens to end in digits (e.g. wwn-0x5000...)
+        return path
+    if "nvme" in path or "mmcblk" in path:
+        # These disk names end in a digit, so partitions carry a "p" separator
+        return path[: i - 1] if path[i - 1] == "p" else path
+    return path[:i]
+
+
+def _zpool_base_device(devpath: str, by_id_links: dict[str, str]) -> str:
+    """
+    Base disk for a vdev path. /dev/disk links are resolved to the kernel device
+    first: by-id names via the read_by_id_links() map, and anything that map
+    doesn't cover (other /dev/disk/by-* links, unindexed names) via realpath.
+    """
+    if devpath.startswith("/dev/disk/"):
+        target = None
+        if devpath.startswith("/dev/disk/by-id/"):
+            target = by_id_links.get(devpath[len("/dev/disk/by-id/") :])
+        devpath = target or os.path.realpath(devpath)
+    return _strip_partition(devpath)
+
+
+def _zpool_leaf_paths(node: dict | list) -> Iterable[str]:
+    """
+    Yield the path of every disk vdev nested anywhere under a JSON vdev tree.
+    `zpool status -j` nests vdevs in dicts keyed by name and tags them with
+    "vdev_type"; the kstat tree nests them in "children" lists with "type".
+    """
+    if isinstance(node, list):
+        for item in node:
+            yield from _zpool_leaf_paths(item)
+        return
+    if not isinstance(node, dict):
+        # Scalars such as counters ("ops": [0, 1]) hold no vdevs
+        return
+    vdev_type = node.get("vdev_type", node.get("type", "disk"))
+    if vdev_type == "disk":
+        # In `zpool status -j -L -P` output "name" is the resolved device (/dev/sdc1),
+        # while "path" is the configured one (/dev/disk/by-partuuid/...). Kstat
+        # leaves only carry "path".
+        devpath = node.get("name") if "vdev_type" in node else None
+        if not (isinstance(devpath, str) and devpath.startswith("/dev/")):
+            devpath = node.get("path")
+        if isinstance(devpath, str):
+            yield devpath
+    for value in node.values():
+        if isinstance(value, (dict, list)):
+            yield from _zpool_leaf_paths(value)
+
+
+def _read_kstat_pool_map(by_id_links: dict[str, str]) -> dict[str, str] | None:
+    """
+    Map base device -> pool from each pool's `status.json` kstat, without
+    running zpool. Returns None unless every imported pool provides one, so
+    the caller falls back to `zpool status`.
+    """
     try:
-        with open(model_path) as f:
-            model = f.read().strip().upper()
-    except Exception:
-        pass
+        with os.scandir(ZFS_KSTAT_DIR) as it:
+            pools = [entry.name for entry in it if entry.is_dir()]
+    except OSError:
+        return None
+    if not pools:
+        return None
 
-    if "QEMU" in vend or "QEMU" in model or "VIRTUAL" in vend or "VIRTUAL" in model:
-        return True
+    pool_map: dict[str, str] = {}
+    for pool in pools:
+        # Any unreadable or unexpectedly shaped file makes the kstats unusable
+        try:
+            with open(f"{ZFS_KSTAT_DIR}/{pool}/status.json", "rb") as f:
+                status = json.load(f)
+            tree = status.get("vdev_tree", status)
+            if not isinstance(tree, (dict, list)):
+                raise ValueError(f"vdev_tree is {type(tree).__name__}")
+            name = status.get("name", pool)
+            for devpath in _zpool_leaf_paths(tree):
+                pool_map[_zpool_base_device(devpath, by_id_links)] = name
+        except Exception as e:
+            logger.debug("pool=%s kstat status.json unusable: %r", pool, e)
+            return None
+    return pool_map
 
-    base_id = os.path.basename(get_persistent_id(dev))
-    return base_id.startswith(("scsi-0QEMU_", "ata-QEMU_", "virtio-"))
 
+def _parse_zpool_status_json(stdout: str, by_id_links: dict[str, str]) -> dict[str, str]:
+    """Map base device -> pool from `zpool status -j` output (OpenZFS 2.3+)."""
+    pool_map: dict[str, str] = {}
+    for name, pool in json.loads(stdout)["pools"].items():
+        for devpath in _zpool_leaf_paths(pool):
+            pool_map[_zpool_base_device(devpath, by_id_links)] = name
+    return pool_map
 
-def get_zpool_device_map() -> dict[str, str]:
+
+def _parse_zpool_status_text(stdout: str, by_id_links: dict[str, str]) -> dict[str, str]:
+    """Map base device -> pool from the human-readable `zpool status -PLp` output."""
+    pool_map: dict[str, str] = {}
+    current_pool: str | None = None
+    in_config = False
+
+    # One finditer pass over the whole output; only pool headers, config: markers and
+    # device lines match, so headers and vdev labels (NAME, mirror-0, logs, ...) never
+    # reach Python code.
+    for m in _ZPOOL_STATUS_RE.finditer(stdout):
+        pool, devpath = m.group("pool", "dev")
+        if pool is not None:
+            current_pool = pool
+            in_config = False
+        elif devpath is None:
+            in_config = True
+        elif in_config and current_pool:
+            # e.g. /dev/sdd1, /dev/disk/by-id/ata-SN123-part1
+            pool_map[_zpool_base_device(devpath, by_id_links)] = current_pool
+
+    return pool_map
+
+
+def _run_zpool_status(*flags: str) -> tuple[int, str]:
+    """
+    Run `zpool status <flags> -PLp` and return (exit status, stdout).
+    -P prints full paths, -L follows symlinks, -p prints exact numbers.
+    Output is captured as bytes and decoded once, without newline translation.
+    """
+    result = subprocess.run(
+        [ZPOOL_PATH or "zpool", "status", *flags, "-PLp"],
+        capture_output=True,
+        timeout=5,
+        close_fds=False,
+    )
+    return result.returncode, result.stdout.decode(errors="replace")
+
+
+# Whether `zpool status -j` works here; None until the first attempt.
+_zpool_json_supported: bool | None = None
+
+
+def _load_zpool_device_map() -> dict[str, str] | None:
     """
-    Optionally map base device -> zpool name by parsing `zpool status -L -P`.
-    Returns dict like {"/dev/sdX": "tank"}.
-    If zpool is unavailable, returns {} quickly.
+    Map base device -> zpool name, like {"/dev/sdX": "tank"}.
+    Reads the per-pool kstats when the ZFS module exports them; otherwise runs
+    `zpool status`, using the JSON output (`-j`) where the installed OpenZFS
+    supports it and the text output otherwise. If zpool is unavailable,
+    returns {} quickly; if it fails (timeout, unreadable output), returns None.
     """
-    if shutil.which("zpool") is None:
+    global _zpool_json_supported
+    by_id_links = read_by_id_links()
+    pool_map = _read_kstat_pool_map(by_id_links)
+    if pool_map is not None:
+        return pool_map
+    if ZPOOL_PATH is None:
         return {}
 
-    pool_map: dict[str, str] = {}
     try:
-        # -P prints full paths, -L follows symlinks
-        result = subprocess.run(
-            ["zpool", "status", "-L", "-P"],
-            capture_output=True,
-            text=True,
-            timeout=5,
-        )
-        current_pool: str | None = None
-        in_config = False
-
-        for raw in result.stdout.splitlines():
-            line = raw.rstrip()
-
-            if line.strip().startswith("pool:"):
-                current_pool = line.split(":", 1)[1].strip()
-                in_config = False
-                continue
-            if line.strip().startswith("config:"):
-                in_config = True
-                continue
-            if not in_config or not current_pool:
-                continue
-
-            s = line.strip()
-            # Skip headers/virtual vdev labels
-            if re.match(r"^(NAME|mirror-|special|logs|spare|cache|raidz|stripe)", s):
-                continue
-
-            # Try to capture a real device path, possibly a partition
-            # e.g. /dev/sdd1, /dev/disk/by-id/ata-SN123-part1
-            m = re.match(r"^(/dev/\S+)", s)
-            if not m:
-                continue
-
-            devpath = m.group(1)
-            # Strip partition suffix for base disk, but keep /dev/disk/by-id paths
-            if devpath.startswith("/dev/disk/by-id/"):
-                # Try to resolve to real base device for matching
-                real = os.path.realpath(devpath)
-                base = re.sub(r"p?\d+$", "", real)
-                pool_map[base] = current_pool
+        if _zpool_json_supported is not False:
+            returncode, out = _run_zpool_status("-j")
+            try:
+                if returncode != 0:
+                    raise ValueError(f"exit status {returncode}")
+                pool_map = _parse_zpool_status_json(out, by_id_links)
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                # Only a failure on the first try marks -j unsupported; later ones
+                # just fall through to the text output for this refresh.
+                if _zpool_json_supported is None:
+                    logger.info("zpool status -j unavailable (%s); using text output", e)
+                    _zpool_json_supported = False
             else:
-                base = re.sub(r"p?\d+$", "", devpath)
-                pool_map[base] = current_pool
+                _zpool_json_supported = True
+                return pool_map
+
+        return _parse_zpool_status_text(_run_zpool_status()[1], by_id_links)
 
     except Exception as e:
-        logger.error(f"ERR [zpool] skipped (error: {e})")
-        return {}
+        logger.error("ERR [zpool] skipped (error: %s)", e)
+        return None
 
-    return pool_map
+
+def get_zpool_device_map() -> dict[str, str]:
+    """
+    Optionally map base device -> zpool name.
+    Returns dict like {"/dev/sdX": "tank"}, or {} if zpool is unavailable or fails.
+    """
+    pool_map = _load_zpool_device_map()
+    return {} if pool_map is None else pool_map
+
+
+async def refresh_pool_map_forever() -> None:
+    """
+    Re-parse `zpool status` every POOL_REFRESH_SECONDS and publish the result,
+    keeping the zpool fork off the /metrics request path. A failed refresh is
+    logged and the last published map is kept until the next attempt.
+    """
+    global _pool_map
+    while True:
+        try:
+            pool_map = await asyncio.to_thread(_load_zpool_device_map)
+        except Exception as e:
+            logger.error("ERR [zpool] pool map refresh failed: %r", e)
+        else:
+            if pool_map is not None:
+                _pool_map = pool_map
+        await asyncio.sleep(POOL_REFRESH_SECONDS)
+
+
+async def current_pool_map() -> dict[str, str]:
+    """
+    Return the map published by the refresher. Before the first refresh has
+    completed (or when running without the app lifespan), parse it inline in
+    a worker thread so zpool never blocks the event loop.
+    """
+    if _pool_map is None:
+        return await asyncio.to_thread(get_zpool_device_map)
+    return _pool_map
 
 
 def smartctl_power_state(dev: str) -> str:
@@ -270,45 +588,42 @@ def smartctl_power_state(dev: str) -> str:
         return "unknown"
 
     try:
+        # An absolute executable with close_fds=False lets subprocess launch via
+        # os.posix_spawn instead of fork+exec with a PATH search. Python-created
+        # fds are non-inheritable (PEP 446), so nothing leaks into smartctl.
         result = subprocess.run(
-            ["smartctl", "-d", "sat,12", "-n", "standby", "-i", dev],
+            [SMARTCTL_PATH or "smartctl", "-d", "sat,12", "-n", "standby", "-i", dev],
             capture_output=True,
-            text=True,
             timeout=10,
+            close_fds=False,
         )
     except subprocess.TimeoutExpired:
         set_device_cooldown(dev)
-        logger.error(f"ERR [{dev}] smartctl timeout")
+        logger.error("ERR [%s] smartctl timeout", dev)
         return "unknown"
     except Exception as e:
-        logger.error(f"ERR [{dev}] smartctl error: {e}")
+        logger.error("ERR [%s] smartctl error: %s", dev, e)
         return "error"
 
-    out = result.stdout or ""
-    uout = out.upper()
+    out = result.stdout or b""
 
     # Skip devices that clearly don't support SMART (e.g., virtual devices)
-    for line in out.splitlines():
-        if re.search(r"SMART support is:\s+Unavailable", line, flags=re.IGNORECASE):
-            logger.info("INFO [%s] SMART unsupported; skipping", dev)
-            return "unknown"
-
-    if "STANDBY" in uout:
-        return "standby"
-    if "SLEEP" in uout:
-        return "sleep"
-    if "IDLE_A" in uout:
-        return "idle_a"
-    if "IDLE_B" in uout:
-        return "idle_b"
-    if "IDLE_C" in uout:
-        return "idle_c"
-    if "ACTIVE OR IDLE" in uout or "ACTIVE/IDLE" in uout:
-        return "active_or_idle"
-    if "ACTIVE" in uout:
-        return "active"
-    if "IDLE" in uout:
-        return "idle"
+    if _SMART_UNAVAILABLE_RE.search(out):
+        logger.info("INFO [%s] SMART unsupported; skipping", dev)
+        return "unknown"
+
+    # Active drives report "Power mode is: ACTIVE or IDLE" (or "was:") on one line;
+    # when present, classify that line alone instead of the whole identify dump.
+    i = out.find(b"Power mode ")
+    if i >= 0:
+        j = out.find(b"\n", i)
+        out = out[i : j if j >= 0 else None]
+
+    # One regex pass collects every state token; precedence is applied afterwards
+    found = {token.upper().decode("ascii") for token in _SMART_STATE_RE.findall(out)}
+    for token, state in SMART_STATE_PRECEDENCE:
+        if token in found:
+            return state
 
     # If smartctl returned normally but none of the sleeping tokens appeared,
     # treat it as the non-waking "active_or_idle" bucket.
@@ -318,54 +633,244 @@ def smartctl_power_state(dev: str) -> str:
     return "unknown"
 
 
+# `hdparm -C` "drive state is:" values -> STATE_MAP keys
+HDPARM_STATES: dict[str, str] = {
+    "standby": "standby",
+    "sleeping": "sleep",
+    "idle": "idle",
+    "idle_a": "idle_a",
+    "idle_b": "idle_b",
+    "idle_c": "idle_c",
+    "active/idle": "active_or_idle",
+    "active": "active",
+}
+
+
+def _hdparm_state(rest: bytes) -> str:
+    """Map the bytes following "drive state is:" to a STATE_MAP key."""
+    words = rest.split(None, 1)
+    if not words:
+        return "unknown"
+    return HDPARM_STATES.get(words[0].decode("ascii", "replace").lower(), "unknown")
+
+
+def hdparm_power_state(dev: str) -> str:
+    """
+    Ask the drive for its power mode with `hdparm -C`, which issues a single
+    ATA CHECK POWER MODE command (no identify dump, doesn't wake the drive).
+    """
+    if is_device_in_cooldown(dev):
+        logger.debug("device=%s skipped (in cooldown)", dev)
+        return "unknown"
+
+    try:
+        result = subprocess.run(
+            [HDPARM_PATH or "hdparm", "-C", dev],
+            capture_output=True,
+            timeout=10,
+            close_fds=False,
+        )
+    except subprocess.TimeoutExpired:
+        set_device_cooldown(dev)
+        logger.error("ERR [%s] hdparm timeout", dev)
+        return "unknown"
+    except Exception as e:
+        logger.error("ERR [%s] hdparm error: %s", dev, e)
+        return "error"
+
+    out = result.stdout or b""
+    i = out.find(b"drive state is:")
+    if i < 0:
+        return "unknown"
+    return _hdparm_state(out[i + len(b"drive state is:") :])
+
+
+def hdparm_power_states(devs: list[str]) -> dict[str, str]:
+    """
+    Probe several drives with one `hdparm -C dev1 dev2 ...` process instead of
+    one per drive. Devices in cooldown are reported "unknown" without being
+    probed. Devices missing from the output (or every device, if the batch
+    fails) are left out so the caller can probe them individually.
+    """
+    states = {dev: "unknown" for dev in devs if is_device_in_cooldown(dev)}
+    todo = [dev for dev in devs if dev not in states]
+    if not todo:
+        return states
+
+    try:
+        result = subprocess.run(
+            [HDPARM_PATH or "hdparm", "-C", *todo],
+            capture_output=True,
+            timeout=10 + len(todo),
+            close_fds=False,
+        )
+    except Exception as e:
+        logger.error("ERR hdparm batch of %d devices failed: %r", len(todo), e)
+        return states
+
+    # Output is one block per device: "/dev/sdX:" then " drive state is:  <state>"
+    wanted = {dev.encode(): dev for dev in todo}
+    current = None
+    for line in (result.stdout or b"").splitlines():
+        line = line.strip()
+        if line.endswith(b":") and line[:-1] in wanted:
+            current = wanted[line[:-1]]
+        elif current is not None and line.startswith(b"drive state is:"):
+            states[current] = _hdparm_state(line[len(b"drive state is:") :])
+            current = None
+    return states
+
+
+def probe_power_state(dev: str) -> str:
+    """Run one power-state probe with the configured POWER_PROBE backend."""
+    if POWER_PROBE == "hdparm" and HDPARM_PATH is not None:
+        return hdparm_power_state(dev)
+    return smartctl_power_state(dev)
+
+
 async def async_highest_power_state(
     dev: str, attempts: int = PROBE_ATTEMPTS, interval_ms: int = PROBE_INTERVAL_MS
 ) -> str:
     """
-    Probe smartctl multiple times (without waking the drive) and return the
-    highest-activity state observed. Runs the sync smartctl parser in a thread.
+    Probe multiple times (without waking the drive) and return the
+    highest-activity state observed. Runs the sync probe in a thread.
+    Each probe holds a slot of the shared semaphore only while smartctl runs,
+    so the sleep between attempts doesn't block other devices. Stops early once
+    the drive reports "active", or two consecutive "standby"/"sleep" results
+    with nothing higher seen.
     """
     highest = "unknown"
+    previous = None
+    loop = asyncio.get_running_loop()
     for i in range(attempts):
-        s = await asyncio.to_thread(smartctl_power_state, dev)
+        async with _probe_semaphore:
+            s = await loop.run_in_executor(_probe_executor, probe_power_state, dev)
         highest = highest_activity_state(highest, s)
+        # Nothing outranks "active". And once two probes in a row agree the drive
+        # is spun down with nothing higher seen, more probes only add ATA commands.
+        if ACTIVITY_RANK.get(highest, 0) >= ACTIVITY_RANK["active"]:
+            break
+        if s in ("standby", "sleep") and s == previous == highest:
+            break
+        previous = s
         if i + 1 < attempts and interval_ms > 0:
             await asyncio.sleep(interval_ms / 1000.0)
     return highest
 
 
-async def gather_device_metrics(dev: str, pool_map: dict[str, str]) -> dict[str, object] | None:
+def _cache_is_fresh(dev: str) -> bool:
+    cached = _smart_cache.get(dev)
+    return cached is not None and time.monotonic() - cached[0] < SMART_CACHE_SECONDS
+
+
+async def batch_probe_states(devs: list[str]) -> dict[str, str]:
     """
-    Process a single device and return a dict with metric lines and counters.
-    Returns:
-      {"lines": [...], "scanned_hdds": 1} OR {"skipped_non_rotational": 1} / {"skipped_virtual": 1}
+    With POWER_PROBE=hdparm and a single attempt per scrape, probe every device
+    that isn't served from the cache in one hdparm process. Returns {} when
+    batching doesn't apply, leaving each device to its own probe.
     """
-    # Only HDDs are monitored
-    if not is_rotational(dev):
-        return {"skipped_non_rotational": 1}
+    if POWER_PROBE != "hdparm" or HDPARM_PATH is None or PROBE_ATTEMPTS != 1:
+        return {}
+    todo = [dev for dev in devs if not _cache_is_fresh(dev)]
+    if len(todo) < 2:
+        return {}
+    loop = asyncio.get_running_loop()
+    async with _probe_semaphore:
+        return await loop.run_in_executor(_probe_executor, hdparm_power_states, todo)
 
-    # Skip QEMU/virtual devices explicitly
-    if is_virtual_device(dev):
-        return {"skipped_virtual": 1}
 
-    dtype = get_rotational_type(dev)  # should be 'hdd' here, but keep label explicit
-    # Map to pool by base device name (e.g., /dev/sdd from /dev/sdd1)
-    base = re.sub(r"p?\d+$", "", dev)
-    pool = pool_map.get(base, "none")
+async def cached_power_state(dev: str, probed: str | None = None) -> str:
+    """
+    Return the power state for dev, reusing a probe result younger than
+    SMART_CACHE_SECONDS instead of running smartctl again. A state already
+    obtained by a batch probe can be passed as probed.
+    """
+    global _smart_cache_hits
+    if _cache_is_fresh(dev):
+        _smart_cache_hits += 1
+        return _smart_cache[dev][1]
 
-    device_id = get_persistent_id(dev)
+    state = probed if probed is not None else await async_highest_power_state(dev)
+    _smart_cache[dev] = (time.monotonic(), state)
+    return state
 
-    state = await async_highest_power_state(dev)
-    value = STATE_MAP.get(state, STATE_MAP["unknown"])
 
-    # Build metric lines for this device
-    labels = f'device_id="{device_id}",device="{dev}",type="{dtype}",pool="{pool}"'
-    lines = [
-        f"disk_info{{{labels}}} 1",
-        f"disk_power_state{{{labels}}} {value}",
-        f'disk_power_state_string{{{labels},state="{state}"}} 1',
-    ]
-    return {"lines": lines, "scanned_hdds": 1}
+def enumerate_disks(
+    pool_map: dict[str, str], by_id_index: dict[str, list[str]]
+) -> tuple[list[DiskInfo], dict[str, int]]:
+    """
+    Single pass over the block devices: filter to physical HDDs and resolve
+    their labels, so the probe/emit stage does no further sysfs I/O.
+    Returns the HDDs (sorted by device) and the enumerated/skipped counters.
+    """
+    devices = sorted(list_block_devices())
+    present = {os.path.basename(dev) for dev in devices}
+    for kname in _rotational_cache.keys() - present:
+        del _rotational_cache[kname]
+    counts = {"enumerated": len(devices), "skipped_non_rotational": 0, "skipped_virtual": 0}
+    disks: list[DiskInfo] = []
+
+    for dev in devices:
+        # Only HDDs are monitored
+        dtype = get_rotational_type(dev)
+        if dtype != "hdd":
+            counts["skipped_non_rotational"] += 1
+            continue
+
+        # Skip QEMU/virtual devices explicitly; the resolved id is reused for the label
+        device_id = get_persistent_id(dev, by_id_index)
+        if is_virtual_device(dev, by_id_index, device_id):
+            counts["skipped_virtual"] += 1
+            continue
+
+        # /sys/block names whole disks, which is what the pool map is keyed by
+        disks.append(
+            DiskInfo(
+                dev=dev,
+                device_id=device_id,
+                dtype=dtype,
+                pool=pool_map.get(dev, "none"),
+            )
+        )
+
+    return disks, counts
+
+
+# Everything after the label block in the power-state lines depends only on the state,
+# so it is rendered once per known state. STATE_MAP keys need no label escaping.
+_STATE_LINE_SEGMENTS = {
+    state: (b"} %d\ndisk_power_state_string{" % value, b',state="%s"} 1\n' % state.encode())
+    for state, value in STATE_MAP.items()
+}
+
+
+def disk_metric_lines(disk: DiskInfo, state: str) -> bytes:
+    """Render the three metric lines for one HDD as UTF-8 bytes, newline-terminated."""
+    segments = _STATE_LINE_SEGMENTS.get(state)
+    if segments is None:
+        value = STATE_MAP["unknown"]
+        segments = (
+            b"} %d\ndisk_power_state_string{" % value,
+            b',state="%s"} 1\n' % prom_escape_label_value(state).encode(),
+        )
+
+    # The shared label block is escaped, formatted and encoded once, then spliced
+    # into each line as bytes so the body never exists as an intermediate str.
+    esc = prom_escape_label_value
+    esc_id, esc_dev, esc_pool = esc(disk.device_id), esc(disk.dev), esc(disk.pool)
+    labels = f'device_id="{esc_id}",device="{esc_dev}",type="{disk.dtype}",pool="{esc_pool}"'
+    labels_b = labels.encode()
+    return b"".join(
+        (
+            b"disk_info{",
+            labels_b,
+            b"} 1\ndisk_power_state{",
+            labels_b,
+            segments[0],
+            labels_b,
+            segments[1],
+        )
+    )
 
 
 @app.get("/healthz")
@@ -373,78 +878,148 @@ def healthz():
     return {"status": "ok"}
 
 
-@app.get("/metrics")
-async def metrics():
-    t0 = time.perf_counter()
-    enumerated = 0
-    skipped_non_rotational = 0
-    skipped_virtual = 0
-    scanned_hdds = 0
-
-    lines = []
-    # Headers first
-    lines.append(
-        "# HELP disk_power_state Current disk power state as a numeric code "
-        "(0=standby, 7=sleep, 1=idle, 2=active_or_idle, -1=unknown, -2=error, "
-        "3=idle_a, 4=idle_b, 5=idle_c, 6=active)."
-    )
-    lines.append("# TYPE disk_power_state gauge")
-    lines.append("# HELP disk_info Static labels describing the disk (type/pool). Always 1.")
-    lines.append("# TYPE disk_info gauge")
-    lines.append(
-        "# HELP disk_power_state_string Always 1;"
-        " carries the current power state as the 'state' label for display."
+# HELP/TYPE preamble is identical on every scrape, so encode it once.
+METRICS_HEADER = (
+    "\n".join(
+        [
+            "# HELP disk_power_state Current disk power state as a numeric code "
+            "(0=standby, 7=sleep, 1=idle, 2=active_or_idle, -1=unknown, -2=error, "
+            "3=idle_a, 4=idle_b, 5=idle_c, 6=active).",
+            "# TYPE disk_power_state gauge",
+            "# HELP disk_info Static labels describing the disk (type/pool). Always 1.",
+            "# TYPE disk_info gauge",
+            "# HELP disk_power_state_string Always 1;"
+            " carries the current power state as the 'state' label for display.",
+            "# TYPE disk_power_state_string gauge",
+            "# HELP disk_exporter_scan_seconds Duration of the last scan in seconds.",
+            "# TYPE disk_exporter_scan_seconds gauge",
+            "# HELP disk_exporter_devices_total Devices seen / scanned / skipped.",
+            "# TYPE disk_exporter_devices_total gauge",
+            "# HELP disk_exporter_smart_cache_hits_total"
+            " Power-state probes answered from the cache.",
+            "# TYPE disk_exporter_smart_cache_hits_total counter",
+        ]
     )
-    lines.append("# TYPE disk_power_state_string gauge")
-    lines.append("# HELP disk_exporter_scan_seconds Duration of the last scan in seconds.")
-    lines.append("# TYPE disk_exporter_scan_seconds gauge")
-    lines.append("# HELP disk_exporter_devices_total Devices seen / scanned / skipped.")
-    lines.append("# TYPE disk_exporter_devices_total gauge")
+    + "\n"
+).encode()
 
-    pool_map = get_zpool_device_map()
+METRICS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+STREAM_CHUNK_BYTES = 64 * 1024
 
-    devices = sorted(list_block_devices())
-    enumerated = len(devices)
 
-    # Run per-device probes concurrently, bounded by a semaphore
-    sem = asyncio.Semaphore(MAX_CONCURRENCY)
+@app.get("/metrics")
+async def metrics():
+    if METRICS_CACHE_SECONDS > 0:
+        return Response(await _cached_metrics_body(), media_type=METRICS_MEDIA_TYPE)
+    # Enumeration and probe start-up happen before the response is created, so a
+    # failure there is a clean 500 rather than a 200 with a truncated body.
+    scan = await _start_scan()
+    return StreamingResponse(_stream_metrics(*scan), media_type=METRICS_MEDIA_TYPE)
 
-    async def run_with_sem(dev):
-        async with sem:
-            return await gather_device_metrics(dev, pool_map)
 
-    tasks = [asyncio.create_task(run_with_sem(dev)) for dev in devices]
-    results = await asyncio.gather(*tasks, return_exceptions=False)
+async def _cached_metrics_body() -> bytes:
+    """
+    Return a rendered body younger than METRICS_CACHE_SECONDS, scanning at most
+    once per window. Concurrent scrapes queue on the lock and share that scan.
+    """
+    global _metrics_cache
+    async with _metrics_cache_lock:
+        if (
+            _metrics_cache is not None
+            and time.monotonic() - _metrics_cache[0] < METRICS_CACHE_SECONDS
+        ):
+            return _metrics_cache[1]
+        scan = await _start_scan()
+        body = b"".join([chunk async for chunk in _stream_metrics(*scan)])
+        _metrics_cache = (time.monotonic(), body)
+        return body
+
+
+async def _start_scan() -> tuple[float, list[DiskInfo], list[asyncio.Task], dict[str, int]]:
+    """
+    Enumerate the HDDs and start their probes. Returns the arguments for
+    _stream_metrics: scan start time, disks, probe tasks and counters.
+    """
+    t0 = time.perf_counter()
+    disks, counts = enumerate_disks(await current_pool_map(), build_by_id_index())
+
+    # Start every probe now; the body is streamed as probes finish, so the header and
+    # the fastest devices go out while slower drives are still answering.
+    # smartctl calls are bounded by _probe_semaphore.
+    batched = await batch_probe_states([disk.dev for disk in disks])
+    tasks = [
+        asyncio.create_task(cached_power_state(disk.dev, batched.get(disk.dev))) for disk in disks
+    ]
+    return t0, disks, tasks, counts
 
-    # Collect results
-    for r in results:
-        if not r:
-            continue
-        skipped_non_rotational += r.get("skipped_non_rotational", 0)
-        skipped_virtual += r.get("skipped_virtual", 0)
-        scanned_hdds += r.get("scanned_hdds", 0)
-        for line in r.get("lines", []):
-            lines.append(line)
+
+async def _stream_metrics(
+    t0: float, disks: list[DiskInfo], tasks: list[asyncio.Task], counts: dict[str, int]
+) -> AsyncIterator[bytes]:
+    scanned_hdds = 0
+    # Checked once per scrape so the per-device debug line costs nothing when disabled
+    debug = logger.isEnabledFor(logging.DEBUG)
+    # Encoded output accumulates here and goes out as one chunk whenever we'd otherwise
+    # wait on a probe, or once it reaches STREAM_CHUNK_BYTES.
+    buf = bytearray(METRICS_HEADER)
+
+    position = {task: i for i, task in enumerate(tasks)}
+    pending = set(tasks)
+    try:
+        # Devices are written in completion order, so one slow drive doesn't hold
+        # back lines for drives that have already answered.
+        while pending:
+            done = {task for task in pending if task.done()}
+            if not done:
+                if buf:
+                    yield bytes(buf)
+                    buf.clear()
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            pending -= done
+            for task in sorted(done, key=position.__getitem__):
+                disk = disks[position[task]]
+                try:
+                    state = task.result()
+                except Exception as e:
+                    logger.error("ERR [%s] probe failed: %r", disk.dev, e)
+                    continue
+                scanned_hdds += 1
+                if debug:
+                    logger.debug(
+                        "device=%s id=%s pool=%s state=%s",
+                        disk.dev,
+                        disk.device_id,
+                        disk.pool,
+                        state,
+                    )
+                buf += disk_metric_lines(disk, state)
+                if len(buf) >= STREAM_CHUNK_BYTES:
+                    yield bytes(buf)
+                    buf.clear()
+    finally:
+        # No-op after a full pass; on client disconnect, stops probes nobody will read.
+        for task in tasks:
+            task.cancel()
 
     duration = time.perf_counter() - t0
 
-    lines.append(f"disk_exporter_scan_seconds {duration:.6f}")
-    lines.append(f'disk_exporter_devices_total{{kind="enumerated"}} {enumerated}')
-    lines.append(f'disk_exporter_devices_total{{kind="scanned_hdds"}} {scanned_hdds}')
-    lines.append(
-        f'disk_exporter_devices_total{{kind="skipped_non_rotational"}} {skipped_non_rotational}'
-    )
-    lines.append(f'disk_exporter_devices_total{{kind="skipped_virtual"}} {skipped_virtual}')
+    buf += (
+        f"disk_exporter_scan_seconds {duration:.6f}\n"
+        f'disk_exporter_devices_total{{kind="enumerated"}} {counts["enumerated"]}\n'
+        f'disk_exporter_devices_total{{kind="scanned_hdds"}} {scanned_hdds}\n'
+        f'disk_exporter_devices_total{{kind="skipped_non_rotational"}} '
+        f"{counts['skipped_non_rotational']}\n"
+        f'disk_exporter_devices_total{{kind="skipped_virtual"}} {counts["skipped_virtual"]}\n'
+        f"disk_exporter_smart_cache_hits_total {_smart_cache_hits}\n"
+    ).encode()
+    yield bytes(buf)
 
     logger.info(
         "scan complete: enumerated=%d scanned_hdds=%d"
         " skipped_non_rotational=%d skipped_virtual=%d duration=%.3fs",
-        enumerated,
+        counts["enumerated"],
         scanned_hdds,
-        skipped_non_rotational,
-        skipped_virtual,
+        counts["skipped_non_rotational"],
+        counts["skipped_virtual"],
         duration,
     )
-
-    body = "\n".join(lines) + "\n"
-    return Response(body, media_type="text/plain")
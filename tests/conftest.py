@@ -0,0 +1,15 @@
+# tests/conftest.py
+import pytest
+
+import main
+
+
+@pytest.fixture(autouse=True)
+def clear_smart_cache(monkeypatch):
+    """Start every test with empty power-state, response and rotational caches."""
+    main._smart_cache.clear()
+    monkeypatch.setattr(main, "_smart_cache_hits", 0)
+    monkeypatch.setattr(main, "_metrics_cache", None)
+    main._rotational_cache.clear()
+    yield
+    main._smart_cache.clear()
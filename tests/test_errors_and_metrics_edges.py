@@ -1,4 +1,5 @@
 # tests/test_errors_and_metrics_edges.py
+import asyncio
 import subprocess
 
 from fastapi.testclient import TestClient
@@ -21,9 +22,9 @@ def test_smartctl_smart_unsupported(monkeypatch):
         def __init__(self, stdout):
             self.stdout = stdout
             self.returncode = 0
-            self.stderr = ""
+            self.stderr = b""
 
-    out = "SMART support is: Unavailable\nsome other lines"
+    out = b"SMART support is: Unavailable\nsome other lines"
     monkeypatch.setattr(subprocess, "run", lambda *a, **kw: FakeRun(out))
     assert main.smartctl_power_state("/dev/sdz") == "unknown"
 
@@ -41,10 +42,9 @@ def test_metrics_no_devices(monkeypatch):
 def test_metrics_unknown_state_fallback(monkeypatch):
     client = TestClient(main.app)
     monkeypatch.setattr(main, "list_block_devices", lambda: ["/dev/sdy"])
-    monkeypatch.setattr(main, "is_rotational", lambda d: True)
-    monkeypatch.setattr(main, "is_virtual_device", lambda d: False)
+    monkeypatch.setattr(main, "is_virtual_device", lambda d, *_: False)
     monkeypatch.setattr(main, "get_rotational_type", lambda d: "hdd")
-    monkeypatch.setattr(main, "get_persistent_id", lambda d: "/dev/disk/by-id/FAKE-sdy")
+    monkeypatch.setattr(main, "get_persistent_id", lambda d, *_: "/dev/disk/by-id/FAKE-sdy")
     monkeypatch.setattr(main, "get_zpool_device_map", lambda: {})
 
     async def fake_highest(*a, **kw):
@@ -68,3 +68,114 @@ def test_metrics_unknown_state_fallback(monkeypatch):
     # And the string metric should carry the original unknown state label
     assert "disk_power_state_string" in body
     assert 'state="totally_new_state"' in body
+
+
+def test_metrics_single_device_failure_does_not_fail_scrape(monkeypatch):
+    client = TestClient(main.app)
+    monkeypatch.setattr(main, "list_block_devices", lambda: ["/dev/sda", "/dev/sdb"])
+    monkeypatch.setattr(main, "is_virtual_device", lambda d, *_: False)
+    monkeypatch.setattr(main, "get_rotational_type", lambda d: "hdd")
+    monkeypatch.setattr(main, "get_persistent_id", lambda d, *_: f"/dev/disk/by-id/FAKE-{d[-3:]}")
+    monkeypatch.setattr(main, "get_zpool_device_map", lambda: {})
+
+    async def fake_highest(dev, *a, **kw):
+        if dev == "/dev/sda":
+            raise RuntimeError("boom")
+        return "standby"
+
+    monkeypatch.setattr(main, "async_highest_power_state", fake_highest)
+
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    body = r.text
+    assert 'device="/dev/sda"' not in body
+    assert 'device="/dev/sdb"' in body
+    assert 'disk_exporter_devices_total{kind="scanned_hdds"} 1' in body
+
+
+def test_prom_escape_label_value():
+    assert main.prom_escape_label_value(None) == ""
+    assert main.prom_escape_label_value("plain") == "plain"
+    assert main.prom_escape_label_value('a\\b"c\nd') == 'a\\\\b\\"c\\nd'
+
+
+def test_stream_metrics_coalesces_ready_output(monkeypatch):
+    disks = [
+        main.DiskInfo(dev=f"/dev/sd{c}", device_id=f"/dev/sd{c}", dtype="hdd", pool="none")
+        for c in "ab"
+    ]
+    counts = {"enumerated": 2, "skipped_non_rotational": 0, "skipped_virtual": 0}
+
+    async def collect():
+        async def ready():
+            return "standby"
+
+        tasks = [asyncio.create_task(ready()) for _ in disks]
+        await asyncio.sleep(0)  # let both probes finish before streaming starts
+        return [chunk async for chunk in main._stream_metrics(0.0, disks, tasks, counts)]
+
+    # Everything is ready up front -> a single chunk
+    chunks = asyncio.run(collect())
+    assert len(chunks) == 1
+    assert chunks[0].startswith(main.METRICS_HEADER)
+
+    # Tiny chunk size -> flushed after every device
+    monkeypatch.setattr(main, "STREAM_CHUNK_BYTES", 1)
+    chunks = asyncio.run(collect())
+    assert len(chunks) == 3
+    assert b'device="/dev/sda"' in chunks[0]
+    assert b'device="/dev/sdb"' in chunks[1]
+    assert chunks[2].startswith(b"disk_exporter_scan_seconds ")
+
+
+def test_stream_metrics_emits_in_completion_order():
+    disks = [
+        main.DiskInfo(dev=f"/dev/sd{c}", device_id=f"/dev/sd{c}", dtype="hdd", pool="none")
+        for c in "ab"
+    ]
+    counts = {"enumerated": 2, "skipped_non_rotational": 0, "skipped_virtual": 0}
+
+    async def collect():
+        release = asyncio.Event()
+
+        async def slow():
+            await release.wait()
+            return "active"
+
+        async def fast():
+            return "standby"
+
+        tasks = [asyncio.create_task(slow()), asyncio.create_task(fast())]
+        await asyncio.sleep(0)  # sdb answers, sda is still waiting
+        chunks = []
+        async for chunk in main._stream_metrics(0.0, disks, tasks, counts):
+            chunks.append(chunk)
+            release.set()
+        return chunks
+
+    chunks = asyncio.run(collect())
+    # sdb goes out with the header while sda is still probing
+    assert len(chunks) == 2
+    assert b'device="/dev/sdb"' in chunks[0] and b'device="/dev/sda"' not in chunks[0]
+    assert b'device="/dev/sda"' in chunks[1]
+
+
+def test_metrics_debug_logs_per_device(monkeypatch, caplog):
+    client = TestClient(main.app)
+    monkeypatch.setattr(main, "list_block_devices", lambda: ["/dev/sda"])
+    monkeypatch.setattr(main, "is_virtual_device", lambda d, *_: False)
+    monkeypatch.setattr(main, "get_rotational_type", lambda d: "hdd")
+    monkeypatch.setattr(main, "get_persistent_id", lambda d, *_: "/dev/disk/by-id/FAKE-sda")
+    monkeypatch.setattr(main, "get_zpool_device_map", lambda: {})
+
+    async def fake_highest(*a, **kw):
+        return "standby"
+
+    monkeypatch.setattr(main, "async_highest_power_state", fake_highest)
+
+    caplog.set_level("DEBUG", logger="disk_status_exporter")
+    client.get("/metrics")
+    assert any(
+        "device=/dev/sda" in rec.getMessage() and "state=standby" in rec.getMessage()
+        for rec in caplog.records
+    )
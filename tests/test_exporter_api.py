@@ -22,13 +22,12 @@ def test_metrics_happy_path(monkeypatch):
     client = TestClient(main.app)
 
     monkeypatch.setattr(main, "list_block_devices", lambda: ["/dev/sda", "/dev/sdb"])
-    monkeypatch.setattr(main, "is_rotational", lambda dev: True)
-    monkeypatch.setattr(main, "is_virtual_device", lambda dev: False)
+    monkeypatch.setattr(main, "is_virtual_device", lambda dev, *_: False)
     monkeypatch.setattr(main, "get_rotational_type", lambda dev: "hdd")
     monkeypatch.setattr(
         main,
         "get_persistent_id",
-        lambda dev: f"/dev/disk/by-id/FAKE-{dev.split('/')[-1]}",
+        lambda dev, *_: f"/dev/disk/by-id/FAKE-{dev.split('/')[-1]}",
     )
     monkeypatch.setattr(
         main, "get_zpool_device_map", lambda: {"/dev/sda": "tank", "/dev/sdb": "backup"}
@@ -81,18 +80,15 @@ def test_metrics_skip_non_rotational_and_virtual(monkeypatch):
     # 3 devices: one SSD, one virtual, one real HDD
     monkeypatch.setattr(main, "list_block_devices", lambda: ["/dev/sda", "/dev/sdb", "/dev/sdc"])
 
-    def fake_is_rotational(dev):
-        return dev != "/dev/sda"  # sda -> SSD (non-rotational)
-
-    monkeypatch.setattr(main, "is_rotational", fake_is_rotational)
-    monkeypatch.setattr(main, "is_virtual_device", lambda dev: dev == "/dev/sdb")
+    monkeypatch.setattr(main, "is_virtual_device", lambda dev, *_: dev == "/dev/sdb")
+    # sda -> SSD (non-rotational)
     monkeypatch.setattr(
         main, "get_rotational_type", lambda dev: "hdd" if dev != "/dev/sda" else "ssd"
     )
     monkeypatch.setattr(
         main,
         "get_persistent_id",
-        lambda dev: f"/dev/disk/by-id/FAKE-{dev.split('/')[-1]}",
+        lambda dev, *_: f"/dev/disk/by-id/FAKE-{dev.split('/')[-1]}",
     )
     monkeypatch.setattr(main, "get_zpool_device_map", lambda: {})
 
@@ -115,3 +111,72 @@ def test_metrics_skip_non_rotational_and_virtual(monkeypatch):
     assert 'device="/dev/sdc"' in body
     assert 'device="/dev/sda"' not in body
     assert 'device="/dev/sdb"' not in body
+
+
+def test_metrics_escapes_label_values(monkeypatch):
+    client = TestClient(main.app)
+
+    monkeypatch.setattr(main, "list_block_devices", lambda: ["/dev/sda"])
+    monkeypatch.setattr(main, "is_virtual_device", lambda dev, *_: False)
+    monkeypatch.setattr(main, "get_rotational_type", lambda dev: "hdd")
+    monkeypatch.setattr(main, "get_persistent_id", lambda dev, *_: '/dev/disk/by-id/ata-"Q"')
+    monkeypatch.setattr(main, "get_zpool_device_map", lambda: {"/dev/sda": "ta\\nk"})
+
+    async def fake_highest(dev, *_, **__):
+        return "standby"
+
+    monkeypatch.setattr(main, "async_highest_power_state", fake_highest)
+
+    body = client.get("/metrics").text
+    assert (
+        'disk_info{device_id="/dev/disk/by-id/ata-\\"Q\\"",'
+        'device="/dev/sda",type="hdd",pool="ta\\\\nk"} 1' in body
+    )
+
+
+def test_metrics_response_cache_reuses_body(monkeypatch):
+    client = TestClient(main.app)
+    calls = []
+
+    def fake_list():
+        calls.append(1)
+        return ["/dev/sda"]
+
+    monkeypatch.setattr(main, "METRICS_CACHE_SECONDS", 60.0)
+    monkeypatch.setattr(main, "list_block_devices", fake_list)
+    monkeypatch.setattr(main, "is_virtual_device", lambda dev, *_: False)
+    monkeypatch.setattr(main, "get_rotational_type", lambda dev: "hdd")
+    monkeypatch.setattr(main, "get_persistent_id", lambda dev, *_: "/dev/disk/by-id/FAKE")
+    monkeypatch.setattr(main, "get_zpool_device_map", lambda: {})
+
+    async def fake_highest(dev, *_, **__):
+        return "standby"
+
+    monkeypatch.setattr(main, "async_highest_power_state", fake_highest)
+
+    first = client.get("/metrics")
+    second = client.get("/metrics")
+    assert first.status_code == second.status_code == 200
+    assert first.text == second.text
+    assert first.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'disk_power_state_string{device_id="/dev/disk/by-id/FAKE"' in first.text
+    assert len(calls) == 1
+
+    # An expired entry triggers a fresh scan.
+    monkeypatch.setattr(main, "METRICS_CACHE_SECONDS", 1e-9)
+    client.get("/metrics")
+    assert len(calls) == 2
+
+
+def test_metrics_enumeration_failure_is_500(monkeypatch):
+    client = TestClient(main.app, raise_server_exceptions=False)
+
+    def broken():
+        raise RuntimeError("sysfs unavailable")
+
+    monkeypatch.setattr(main, "list_block_devices", broken)
+    monkeypatch.setattr(main, "get_zpool_device_map", lambda: {})
+
+    # Failures before streaming starts must not surface as a truncated 200
+    r = client.get("/metrics")
+    assert r.status_code == 500
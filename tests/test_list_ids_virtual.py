@@ -1,112 +1,189 @@
 # tests/test_list_ids_virtual.py
-import builtins
-import glob
 import os
 
 import main
 
 
-def test_list_block_devices_filters(monkeypatch):
-    # Simulate /sys/block entries and existence of some /dev nodes
-    monkeypatch.setattr(os.path, "isdir", lambda p: True if p == "/sys/block" else os.path.isdir(p))
-    sys_entries = [
-        "loop0",
-        "ram0",
-        "fd0",
-        "sr0",
-        "md0",
-        "zd16",
-        "dm-0",
-        "sda",
-        "nvme0n1",
-        "vda",
-    ]
-    monkeypatch.setattr(
-        os, "listdir", lambda p: sys_entries if p == "/sys/block" else os.listdir(p)
-    )
+def test_list_block_devices_filters(monkeypatch, tmp_path):
+    # Simulate /sys/block entries
+    for kname in ["loop0", "ram0", "fd0", "sr0", "md0", "zd16", "dm-0", "sda", "nvme0n1", "vda"]:
+        (tmp_path / kname).mkdir()
+    monkeypatch.setattr(main, "SYS_BLOCK_DIR", str(tmp_path))
+    dev_nodes = {"/dev/sda", "/dev/nvme0n1", "/dev/vda"}
+    monkeypatch.setattr(os, "access", lambda p, mode: p in dev_nodes)
 
-    def fake_exists(p):
-        # only mark these as existing device nodes
-        return p in {"/dev/sda", "/dev/nvme0n1", "/dev/vda"}
+    devs = sorted(main.list_block_devices())
+    # Only physical-ish block devices should survive
+    assert devs == ["/dev/nvme0n1", "/dev/sda", "/dev/vda"]
 
-    monkeypatch.setattr(os.path, "exists", fake_exists)
 
-    devs = list(main.list_block_devices())
-    # Only physical-ish block devices should survive
-    assert devs == ["/dev/nvme0n1", "/dev/sda", "/dev/vda"] or devs == [
-        "/dev/sda",
-        "/dev/nvme0n1",
-        "/dev/vda",
-    ]
+def test_list_block_devices_skips_missing_dev_nodes(monkeypatch, tmp_path):
+    # Container: sysfs shows every host disk, /dev only the passed-through ones
+    for kname in ["sda", "sdb", "sdc"]:
+        (tmp_path / kname).mkdir()
+    monkeypatch.setattr(main, "SYS_BLOCK_DIR", str(tmp_path))
+    monkeypatch.setattr(os, "access", lambda p, mode: p == "/dev/sdb")
+
+    assert list(main.list_block_devices()) == ["/dev/sdb"]
+
+
+def test_list_block_devices_missing_sys_block(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "SYS_BLOCK_DIR", str(tmp_path / "missing"))
+    assert list(main.list_block_devices()) == []
 
 
 def test_get_rotational_type_ok_and_error(monkeypatch):
     # happy path
-    def fake_open_ok(path, mode="r", *a, **kw):
-        class F:
-            def __enter__(self):
-                return self
+    monkeypatch.setattr(main, "_read_sysfs", lambda p: "1" if p.endswith("/rotational") else "")
+    assert main.get_rotational_type("/dev/sda") == "hdd"
 
-            def __exit__(self, *a):
-                return False
+    monkeypatch.setattr(main, "_read_sysfs", lambda p: "0")
+    assert main.get_rotational_type("/dev/sdb") == "ssd"
 
-            def read(self):
-                return "1\n" if path.endswith("/rotational") else ""
+    # unreadable -> unknown
+    monkeypatch.setattr(main, "_read_sysfs", lambda p: "")
+    assert main.get_rotational_type("/dev/sdc") == "unknown"
 
-        return F()
 
-    monkeypatch.setattr(builtins, "open", fake_open_ok)
+def test_get_rotational_type_cached_per_kname(monkeypatch):
+    reads = []
+    monkeypatch.setattr(main, "_read_sysfs", lambda p: reads.append(p) or "1")
+    assert main.get_rotational_type("/dev/sda") == "hdd"
     assert main.get_rotational_type("/dev/sda") == "hdd"
+    assert len(reads) == 1
+
+    # A kname that disappears from /sys/block is forgotten, so a reused name is re-read
+    monkeypatch.setattr(main, "list_block_devices", lambda: [])
+    main.enumerate_disks({}, {})
+    assert main.get_rotational_type("/dev/sda") == "hdd"
+    assert len(reads) == 2
+
+    # "unknown" isn't cached
+    monkeypatch.setattr(main, "_read_sysfs", lambda p: reads.append(p) or "")
+    assert main.get_rotational_type("/dev/sdb") == "unknown"
+    assert main.get_rotational_type("/dev/sdb") == "unknown"
+    assert len(reads) == 4
 
-    # error path -> unknown
-    def fake_open_raises(*a, **kw):
-        raise OSError("boom")
 
-    monkeypatch.setattr(builtins, "open", fake_open_raises)
-    assert main.get_rotational_type("/dev/sda") == "unknown"
+def test_read_sysfs(tmp_path):
+    attr = tmp_path / "rotational"
+    attr.write_text("1\n")
+    assert main._read_sysfs(str(attr)) == "1"
+    assert main._read_sysfs(str(tmp_path / "missing")) == ""
+    # directories open fine but fail on read
+    assert main._read_sysfs(str(tmp_path)) == ""
 
 
 def test_get_persistent_id_variants(monkeypatch, tmp_path):
-    # Case 1: /dev/disk/by-id does not exist -> returns dev
-    monkeypatch.setattr(os.path, "isdir", lambda p: p != "/dev/disk/by-id")
-    assert main.get_persistent_id("/dev/sdz") == "/dev/sdz"
+    # Case 1: by-id exists but no candidates -> fallback to dev
+    assert main.get_persistent_id("/dev/sdz", {"/dev/sda": ["ata-OTHER"]}) == "/dev/sdz"
+
+    # Case 2: candidates -> the first (most preferred) name wins
+    monkeypatch.setattr(os.path, "realpath", lambda p: p)
+    index = {"/dev/sdz": ["ata-NICE", "wwn-FAIR"]}
+    assert main.get_persistent_id("/dev/sdz", index) == "/dev/disk/by-id/ata-NICE"
 
-    # Case 2: by-id exists but no candidates -> fallback to dev
-    monkeypatch.setattr(os.path, "isdir", lambda p: True)
-    monkeypatch.setattr(glob, "glob", lambda p: [])
+    # Case 3: /dev/disk/by-id does not exist -> returns dev
+    monkeypatch.setattr(main, "BY_ID_DIR", str(tmp_path / "missing"))
     assert main.get_persistent_id("/dev/sdz") == "/dev/sdz"
 
-    # Case 3: multiple candidates, prefer prefixed & shorter
-    # Simulate that both symlinks resolve to /dev/sdz
-    def fake_realpath(p):
-        return "/dev/sdz" if p.startswith("/dev/disk/by-id/") else p
 
-    monkeypatch.setattr(os.path, "realpath", fake_realpath)
-    monkeypatch.setattr(
-        glob,
-        "glob",
-        lambda p: [
-            "/dev/disk/by-id/xyz-long-generic-id-123",
-            "/dev/disk/by-id/ata-NICE",
-            "/dev/disk/by-id/wwn-FAIR",
-        ],
-    )
-    chosen = main.get_persistent_id("/dev/sdz")
-    # Should prefer ata-/wwn- prefix; with our sort logic ata- wins over wwn-
-    assert chosen == "/dev/disk/by-id/ata-NICE"
+def test_build_by_id_index_groups_links_by_target(monkeypatch, tmp_path):
+    by_id = tmp_path / "by-id"
+    by_id.mkdir()
+    (by_id / "ata-DISK1").symlink_to("../../sda")
+    (by_id / "wwn-0x5000").symlink_to("../../sda")
+    (by_id / "ata-DISK1-part1").symlink_to("../../sda1")
+    (by_id / "not-a-link").write_text("")
+    monkeypatch.setattr(main, "BY_ID_DIR", str(by_id))
+
+    index = main.build_by_id_index()
+    sda = os.path.normpath(os.path.join(str(by_id), "../../sda"))
+    sda1 = os.path.normpath(os.path.join(str(by_id), "../../sda1"))
+    assert index[sda] == ["ata-DISK1", "wwn-0x5000"]
+    assert index[sda1] == ["ata-DISK1-part1"]
+    assert len(index) == 2
+
+    # The forward map used for zpool vdev paths reads the same links
+    assert main.read_by_id_links() == {"ata-DISK1": sda, "wwn-0x5000": sda, "ata-DISK1-part1": sda1}
+
+
+def test_build_by_id_index_preference_order(monkeypatch, tmp_path):
+    names = [
+        "xyz-long-generic-id-123",
+        "wwn-0x5000c500f7425581",
+        "ata-ST16000NM001G-2KK103_ZL2ABCDE",
+        "ata-NICE",
+    ]
+    for name in names:
+        (tmp_path / name).symlink_to("../../sdz")
+    monkeypatch.setattr(main, "BY_ID_DIR", str(tmp_path))
+
+    (candidates,) = main.build_by_id_index().values()
+    # Prefix priority first (ata- beats a shorter wwn-), then shorter, unlisted prefixes last
+    assert candidates == [
+        "ata-NICE",
+        "ata-ST16000NM001G-2KK103_ZL2ABCDE",
+        "wwn-0x5000c500f7425581",
+        "xyz-long-generic-id-123",
+    ]
 
 
 def test_is_virtual_device_by_prefix(monkeypatch):
     # Skip file reads; base_id check alone should classify as virtual
-    monkeypatch.setattr(main, "get_persistent_id", lambda dev: "/dev/disk/by-id/scsi-0QEMU_FAKE")
+    monkeypatch.setattr(
+        main, "get_persistent_id", lambda dev, *_: "/dev/disk/by-id/scsi-0QEMU_FAKE"
+    )
 
     # Force vendor/model reads to return empty (so only base_id rule applies)
-    def fake_open(*a, **kw):
-        raise OSError("nope")
-
-    monkeypatch.setattr(builtins, "open", fake_open)
+    monkeypatch.setattr(main, "_read_sysfs", lambda p: "")
     assert main.is_virtual_device("/dev/vda") is True
 
     # Non-virtual id
-    monkeypatch.setattr(main, "get_persistent_id", lambda dev: "/dev/disk/by-id/ata-REAL")
+    monkeypatch.setattr(main, "get_persistent_id", lambda dev, *_: "/dev/disk/by-id/ata-REAL")
     assert main.is_virtual_device("/dev/sda") is False
+
+    # A pre-resolved device_id skips the lookup entirely
+    def no_lookup(*a):
+        raise AssertionError("get_persistent_id should not be called")
+
+    monkeypatch.setattr(main, "get_persistent_id", no_lookup)
+    assert main.is_virtual_device("/dev/vdb", {}, "/dev/disk/by-id/virtio-abc") is True
+
+
+def test_is_virtual_device_sysfs_vendor(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "SYS_BLOCK_DIR", str(tmp_path))
+    (tmp_path / "vda" / "device").mkdir(parents=True)
+    (tmp_path / "vda" / "device" / "vendor").write_text("QEMU    \n")
+    (tmp_path / "sda" / "device").mkdir(parents=True)
+    (tmp_path / "sda" / "device" / "vendor").write_text("ATA     \n")
+    (tmp_path / "sda" / "device" / "model").write_text("Virtual Disk\n")
+    (tmp_path / "nvme0n1").mkdir()
+
+    reads = []
+    real_read = main._read_sysfs
+    monkeypatch.setattr(main, "_read_sysfs", lambda p: reads.append(p) or real_read(p))
+
+    # A vendor match answers without resolving the by-id link or reading model
+    assert main.is_virtual_device("/dev/vda", {}, "/dev/disk/by-id/ata-REAL") is True
+    assert reads == [f"{tmp_path}/vda/device/vendor"]
+    assert main.is_virtual_device("/dev/sda", {}, "/dev/disk/by-id/ata-REAL") is True
+
+    # No device/ directory: no sysfs reads, only the id prefix rule
+    reads.clear()
+    assert main.is_virtual_device("/dev/nvme0n1", {}, "/dev/disk/by-id/nvme-REAL") is False
+    assert reads == []
+
+
+def test_enumerate_disks_filters_and_labels(monkeypatch):
+    monkeypatch.setattr(main, "list_block_devices", lambda: ["/dev/sdc", "/dev/sdb", "/dev/sda"])
+    monkeypatch.setattr(main, "get_rotational_type", lambda d: "ssd" if d == "/dev/sda" else "hdd")
+    monkeypatch.setattr(main, "is_virtual_device", lambda d, *_: d == "/dev/sdb")
+    monkeypatch.setattr(main, "get_persistent_id", lambda d, *_: f"/dev/disk/by-id/ata-{d[-3:]}")
+
+    disks, counts = main.enumerate_disks({"/dev/sdc": "tank"}, {})
+
+    assert disks == [
+        main.DiskInfo(dev="/dev/sdc", device_id="/dev/disk/by-id/ata-sdc", dtype="hdd", pool="tank")
+    ]
+    assert counts == {"enumerated": 3, "skipped_non_rotational": 1, "skipped_virtual": 1}
@@ -17,8 +17,9 @@ def clear_cooldowns():
 
 class FakeRun:
     def __init__(self, stdout: str, returncode: int = 0):
-        self.stdout = stdout
-        self.stderr = ""
+        # Probes run without text=True, so output arrives as bytes
+        self.stdout = stdout.encode()
+        self.stderr = b""
         self.returncode = returncode
 
 
@@ -129,3 +130,196 @@ def test_smartctl_timeout_triggers_cooldown():
         result = main.smartctl_power_state("/dev/sdc")
         assert result == "unknown"
         assert "/dev/sdc" in main._device_cooldowns
+
+
+def test_cached_power_state_reuses_recent_result(monkeypatch):
+    calls = []
+
+    async def fake_highest(dev, *a, **kw):
+        calls.append(dev)
+        return "standby"
+
+    monkeypatch.setattr(main, "async_highest_power_state", fake_highest)
+    monkeypatch.setattr(main, "SMART_CACHE_SECONDS", 30.0)
+
+    assert asyncio.run(main.cached_power_state("/dev/sdx")) == "standby"
+    assert asyncio.run(main.cached_power_state("/dev/sdx")) == "standby"
+    assert calls == ["/dev/sdx"]
+    assert main._smart_cache_hits == 1
+
+
+def test_cached_power_state_expires(monkeypatch):
+    import time
+
+    states = iter(["standby", "active"])
+
+    async def fake_highest(dev, *a, **kw):
+        return next(states)
+
+    monkeypatch.setattr(main, "async_highest_power_state", fake_highest)
+    monkeypatch.setattr(main, "SMART_CACHE_SECONDS", 30.0)
+
+    monkeypatch.setattr(time, "monotonic", lambda: 1000.0)
+    assert asyncio.run(main.cached_power_state("/dev/sdx")) == "standby"
+
+    monkeypatch.setattr(time, "monotonic", lambda: 1031.0)
+    assert asyncio.run(main.cached_power_state("/dev/sdx")) == "active"
+    assert main._smart_cache_hits == 0
+
+
+def test_smartctl_uses_resolved_binary(monkeypatch):
+    """The resolved smartctl path is exec'd directly, without a PATH search."""
+    monkeypatch.setattr(main, "SMARTCTL_PATH", "/usr/sbin/smartctl")
+    with patch("subprocess.run", return_value=FakeRun("Device is in STANDBY mode")) as mock_run:
+        main.smartctl_power_state("/dev/sdx")
+        assert mock_run.call_args[0][0][0] == "/usr/sbin/smartctl"
+        assert mock_run.call_args[1]["close_fds"] is False
+
+
+def test_smartctl_parsing_power_mode_line_only():
+    """Only the 'Power mode' line is classified when smartctl prints one."""
+    out = (
+        "Device Model:     ST16000NM001G STANDBY-SERIES\n"
+        "SMART support is: Available - device has SMART capability.\n"
+        "Power mode is:    IDLE_B\n"
+    )
+    with patch("subprocess.run", return_value=FakeRun(out)):
+        assert main.smartctl_power_state("/dev/sdx") == "idle_b"
+    with patch("subprocess.run", return_value=FakeRun("Power mode was:   ACTIVE or IDLE")):
+        assert main.smartctl_power_state("/dev/sdx") == "active_or_idle"
+
+
+def test_cooldowns_are_bounded(monkeypatch):
+    monkeypatch.setattr(main, "_MAX_COOLDOWNS", 2)
+    for dev in ("/dev/sda", "/dev/sdb", "/dev/sda", "/dev/sdc"):
+        main.set_device_cooldown(dev)
+    # Re-marking sda refreshed its position, so sdb was the oldest entry
+    assert list(main._device_cooldowns) == ["/dev/sda", "/dev/sdc"]
+    assert main.is_device_in_cooldown("/dev/sda")
+    assert not main.is_device_in_cooldown("/dev/sdb")
+
+
+def test_hdparm_parsing():
+    cases = {
+        "\n/dev/sdx:\n drive state is:  standby\n": "standby",
+        "\n/dev/sdx:\n drive state is:  active/idle\n": "active_or_idle",
+        "\n/dev/sdx:\n drive state is:  sleeping\n": "sleep",
+        "\n/dev/sdx:\n drive state is:  NVcache_spinup\n": "unknown",
+        "\n/dev/sdx:\n drive state is:\n": "unknown",
+        "SG_IO: bad/missing sense data": "unknown",
+    }
+    for out, expected in cases.items():
+        with patch("subprocess.run", return_value=FakeRun(out)):
+            assert main.hdparm_power_state("/dev/sdx") == expected, out
+
+
+def test_hdparm_timeout_and_error():
+    import subprocess
+
+    with patch("subprocess.run", side_effect=subprocess.TimeoutExpired("hdparm", 10)):
+        assert main.hdparm_power_state("/dev/sdc") == "unknown"
+        assert "/dev/sdc" in main._device_cooldowns
+    with patch("subprocess.run", side_effect=OSError("nope")):
+        assert main.hdparm_power_state("/dev/sdd") == "error"
+
+
+def test_hdparm_power_states_batch():
+    out = (
+        "\n/dev/sda:\n drive state is:  standby\n"
+        "\n/dev/sdb:\n drive state is:  active/idle\n"
+        "\n/dev/sdc:\nSG_IO: bad/missing sense data\n"
+    )
+    main.set_device_cooldown("/dev/sdd")
+    with patch("subprocess.run", return_value=FakeRun(out)) as run:
+        states = main.hdparm_power_states(["/dev/sda", "/dev/sdb", "/dev/sdc", "/dev/sdd"])
+    # One process for every device not in cooldown
+    assert run.call_count == 1
+    assert run.call_args[0][0][-3:] == ["/dev/sda", "/dev/sdb", "/dev/sdc"]
+    # sdc is left out so the caller can fall back to a per-device probe
+    assert states == {"/dev/sda": "standby", "/dev/sdb": "active_or_idle", "/dev/sdd": "unknown"}
+
+    with patch("subprocess.run", side_effect=OSError("nope")):
+        assert main.hdparm_power_states(["/dev/sda"]) == {}
+
+
+def test_batch_probe_states_only_for_single_hdparm_probe(monkeypatch):
+    seen = []
+
+    def fake_batch(devs):
+        seen.append(devs)
+        return dict.fromkeys(devs, "standby")
+
+    monkeypatch.setattr(main, "hdparm_power_states", fake_batch)
+    monkeypatch.setattr(main, "HDPARM_PATH", "/usr/sbin/hdparm")
+    monkeypatch.setattr(main, "PROBE_ATTEMPTS", 1)
+    devs = ["/dev/sda", "/dev/sdb", "/dev/sdc"]
+
+    monkeypatch.setattr(main, "POWER_PROBE", "smartctl")
+    assert asyncio.run(main.batch_probe_states(devs)) == {}
+
+    monkeypatch.setattr(main, "POWER_PROBE", "hdparm")
+    main._smart_cache["/dev/sda"] = (main.time.monotonic(), "active")
+    assert asyncio.run(main.batch_probe_states(devs)) == {
+        "/dev/sdb": "standby",
+        "/dev/sdc": "standby",
+    }
+    # Fresh cache entries aren't re-probed
+    assert seen == [["/dev/sdb", "/dev/sdc"]]
+
+    # Batched results are cached and aren't counted as cache hits
+    assert asyncio.run(main.cached_power_state("/dev/sdb", "standby")) == "standby"
+    assert main._smart_cache["/dev/sdb"][1] == "standby"
+    assert main._smart_cache_hits == 0
+
+    monkeypatch.setattr(main, "PROBE_ATTEMPTS", 3)
+    assert asyncio.run(main.batch_probe_states(devs)) == {}
+
+
+def test_probe_power_state_backend_selection(monkeypatch):
+    monkeypatch.setattr(main, "smartctl_power_state", lambda dev: "from_smartctl")
+    monkeypatch.setattr(main, "hdparm_power_state", lambda dev: "from_hdparm")
+
+    monkeypatch.setattr(main, "POWER_PROBE", "smartctl")
+    assert main.probe_power_state("/dev/sdx") == "from_smartctl"
+
+    monkeypatch.setattr(main, "POWER_PROBE", "hdparm")
+    monkeypatch.setattr(main, "HDPARM_PATH", None)
+    assert main.probe_power_state("/dev/sdx") == "from_smartctl"
+
+    monkeypatch.setattr(main, "HDPARM_PATH", "/usr/sbin/hdparm")
+    assert main.probe_power_state("/dev/sdx") == "from_hdparm"
+
+
+def test_async_highest_power_state_stops_at_active(monkeypatch):
+    calls = []
+
+    def fake_sync(dev):
+        calls.append(dev)
+        return "active"
+
+    monkeypatch.setattr(main, "smartctl_power_state", fake_sync)
+    res = asyncio.run(main.async_highest_power_state("/dev/sdx", attempts=5, interval_ms=0))
+    assert res == "active"
+    assert len(calls) == 1
+
+
+def test_async_highest_power_state_stops_when_standby_repeats(monkeypatch):
+    for low in ("standby", "sleep"):
+        calls = []
+
+        def fake_sync(dev, low=low, calls=calls):
+            calls.append(dev)
+            return low if len(calls) <= 2 else "active"
+
+        monkeypatch.setattr(main, "smartctl_power_state", fake_sync)
+        res = asyncio.run(main.async_highest_power_state("/dev/sdx", attempts=5, interval_ms=0))
+        assert res == low
+        assert len(calls) == 2
+
+
+def test_async_highest_power_state_keeps_probing_when_states_disagree(monkeypatch):
+    seq = iter(["unknown", "idle_a", "standby", "standby", "idle"])
+
+    monkeypatch.setattr(main, "smartctl_power_state", lambda dev: next(seq))
+    res = asyncio.run(main.async_highest_power_state("/dev/sdx", attempts=5, interval_ms=0))
+    assert res == "idle"
@@ -1,17 +1,82 @@
 # tests/test_zpool_map.py
-import shutil
+import asyncio
+import json
 import subprocess
 
+import pytest
+
 import main
 
 
+@pytest.fixture(autouse=True)
+def no_zfs_kstats(monkeypatch, tmp_path):
+    """Keep the host's ZFS kstats (if any) out of these tests."""
+    monkeypatch.setattr(main, "ZFS_KSTAT_DIR", str(tmp_path / "no-kstats"))
+
+
+def test_get_zpool_device_map_from_kstat(monkeypatch, tmp_path):
+    kstats = tmp_path / "kstat"
+    (kstats / "tank").mkdir(parents=True)
+    (kstats / "arcstats").write_text("not a pool\n")
+    status = {
+        "name": "tank",
+        "vdev_tree": {
+            "type": "root",
+            "children": [
+                {
+                    "type": "mirror",
+                    "children": [
+                        {"path": "/dev/disk/by-id/ata-DISK123-part1", "ops": [0, 1]},
+                        {"path": "/dev/sdd1"},
+                        # Kstat leaves carry the configured path; resolved via realpath
+                        {"path": "/dev/disk/by-partuuid/ca1eb824-c371-491d-ac13-37637e35c683"},
+                    ],
+                },
+                {"type": "file", "path": "/tmp/scratch.img"},
+            ],
+        },
+    }
+    (kstats / "tank" / "status.json").write_text(json.dumps(status))
+    monkeypatch.setattr(main, "ZFS_KSTAT_DIR", str(kstats))
+    monkeypatch.setattr(main, "ZPOOL_PATH", "/sbin/zpool")
+
+    def no_subprocess(*a, **kw):
+        raise AssertionError("zpool should not run when kstats are available")
+
+    monkeypatch.setattr(subprocess, "run", no_subprocess)
+    monkeypatch.setattr(main, "read_by_id_links", lambda: {"ata-DISK123-part1": "/dev/sdc1"})
+    monkeypatch.setattr(
+        main.os.path, "realpath", lambda p: "/dev/sde1" if "by-partuuid" in p else p
+    )
+
+    assert main.get_zpool_device_map() == {
+        "/dev/sdc": "tank",
+        "/dev/sdd": "tank",
+        "/dev/sde": "tank",
+    }
+
+    # Oddly shaped files make the kstats unusable rather than raising
+    status_file = kstats / "tank" / "status.json"
+    for bad in ({"name": "tank", "vdev_tree": 3}, [1, 2]):
+        status_file.write_text(json.dumps(bad))
+        assert main._read_kstat_pool_map({}) is None
+    # Scalars inside the tree are skipped, not dereferenced
+    status_file.write_text(json.dumps({"vdev_tree": [0, "x", None, {"path": "/dev/sdd1"}]}))
+    assert main._read_kstat_pool_map({}) == {"/dev/sdd": "tank"}
+
+    # A pool without status.json means the kstats aren't usable; fall back to zpool
+    (kstats / "backup").mkdir()
+    assert main._read_kstat_pool_map({}) is None
+
+
 def test_get_zpool_device_map_no_zpool(monkeypatch):
-    monkeypatch.setattr(shutil, "which", lambda x: None)
+    monkeypatch.setattr(main, "ZPOOL_PATH", None)
     assert main.get_zpool_device_map() == {}
 
 
 def test_get_zpool_device_map_parsing(monkeypatch):
-    monkeypatch.setattr(shutil, "which", lambda x: "/sbin/zpool")
+    monkeypatch.setattr(main, "ZPOOL_PATH", "/sbin/zpool")
+    monkeypatch.setattr(main, "_zpool_json_supported", False)
 
     sample = """
   pool: tank
@@ -27,20 +92,273 @@ config:
 errors: No known data errors
 """
 
-    class FakeRun:
-        def __init__(self, stdout):
-            self.stdout = stdout
+    monkeypatch.setattr(main, "_run_zpool_status", lambda *flags: (0, sample))
 
-    monkeypatch.setattr(subprocess, "run", lambda *a, **kw: FakeRun(sample))
+    # by-id vdevs resolve through the /dev/disk/by-id link map, not realpath
+    monkeypatch.setattr(main, "read_by_id_links", lambda: {"ata-DISK123-part1": "/dev/sdc1"})
 
-    # Also ensure realpath resolves the by-id to a real device
-    monkeypatch.setattr(
-        main.os.path,
-        "realpath",
-        lambda p: "/dev/sdc1" if "ata-DISK123-part1" in p else p,
-    )
+    def no_realpath(p):
+        raise AssertionError("realpath should not be needed")
+
+    monkeypatch.setattr(main.os.path, "realpath", no_realpath)
 
     m = main.get_zpool_device_map()
     # Both should be mapped to base device (partition stripped)
     assert m["/dev/sdc"] == "tank"
     assert m["/dev/sdd"] == "tank"
+
+
+def test_parse_zpool_status_text_multiple_pools():
+    sample = """
+  pool: backup
+ state: DEGRADED
+status: One or more devices could not be used.
+   /dev/sdz1 mentioned before config: is ignored
+config:
+
+        NAME                STATE     READ WRITE CKSUM
+        backup              DEGRADED     0     0     0
+          raidz1-0          DEGRADED     0     0     0
+            /dev/sda1       ONLINE       0     0     0
+            /dev/sdb1       UNAVAIL      0     0     0
+        logs
+          /dev/nvme0n1p2    ONLINE       0     0     0
+
+errors: No known data errors
+
+  pool: tank
+ state: ONLINE
+config:
+
+        NAME                STATE     READ WRITE CKSUM
+        tank                ONLINE       0     0     0
+          /dev/disk/by-id/ata-DISK123-part1  ONLINE       0     0     0
+"""
+    links = {"ata-DISK123-part1": "/dev/sdc1"}
+    assert main._parse_zpool_status_text(sample, links) == {
+        "/dev/sda": "backup",
+        "/dev/sdb": "backup",
+        "/dev/nvme0n1": "backup",
+        "/dev/sdc": "tank",
+    }
+
+
+def test_zpool_base_device_resolves_links(monkeypatch):
+    resolved = {
+        "/dev/disk/by-partuuid/ca1eb824-c371-491d-ac13-37637e35c683": "/dev/sde1",
+        "/dev/disk/by-id/ata-NOT-INDEXED-part2": "/dev/sdf2",
+    }
+    monkeypatch.setattr(main.os.path, "realpath", lambda p: resolved.get(p, p))
+    links = {"ata-DISK123-part1": "/dev/sdc1"}
+
+    # Indexed by-id names are a dict lookup; everything else falls back to realpath
+    assert main._zpool_base_device("/dev/disk/by-id/ata-DISK123-part1", links) == "/dev/sdc"
+    assert main._zpool_base_device("/dev/disk/by-id/ata-NOT-INDEXED-part2", links) == "/dev/sdf"
+    assert (
+        main._zpool_base_device("/dev/disk/by-partuuid/ca1eb824-c371-491d-ac13-37637e35c683", links)
+        == "/dev/sde"
+    )
+    assert main._zpool_base_device("/dev/sdd1", links) == "/dev/sdd"
+
+
+def test_get_zpool_device_map_json(monkeypatch):
+    monkeypatch.setattr(main, "ZPOOL_PATH", "/sbin/zpool")
+    monkeypatch.setattr(main, "_zpool_json_supported", None)
+
+    status = {
+        "output_version": {"command": "zpool status", "vers_major": 0, "vers_minor": 1},
+        "pools": {
+            "tank": {
+                "name": "tank",
+                "vdevs": {
+                    "tank": {
+                        "vdev_type": "root",
+                        "vdevs": {
+                            "mirror-0": {
+                                "vdev_type": "mirror",
+                                "vdevs": {
+                                    "/dev/sda1": {"vdev_type": "disk", "path": "/dev/sda1"},
+                                    "/dev/nvme0n1p1": {
+                                        "vdev_type": "disk",
+                                        "path": "/dev/nvme0n1p1",
+                                    },
+                                    # Config path is a by-partuuid link; -L -P
+                                    # resolves the name to the kernel device
+                                    "/dev/sde1": {
+                                        "name": "/dev/sde1",
+                                        "vdev_type": "disk",
+                                        "path": "/dev/disk/by-partuuid/"
+                                        "ca1eb824-c371-491d-ac13-37637e35c683",
+                                    },
+                                },
+                            }
+                        },
+                    }
+                },
+                "spares": {"/dev/sdc": {"vdev_type": "disk", "path": "/dev/sdc"}},
+            },
+            "scratch": {
+                "vdevs": {"scratch": {"vdev_type": "file", "path": "/tmp/scratch.img"}},
+            },
+        },
+    }
+    calls = []
+
+    def fake_status(*flags):
+        calls.append(flags)
+        return 0, json.dumps(status)
+
+    monkeypatch.setattr(main, "_run_zpool_status", fake_status)
+
+    def no_realpath(p):
+        raise AssertionError(f"{p} should come resolved from -L -P")
+
+    monkeypatch.setattr(main.os.path, "realpath", no_realpath)
+
+    assert main.get_zpool_device_map() == {
+        "/dev/sda": "tank",
+        "/dev/nvme0n1": "tank",
+        "/dev/sde": "tank",
+        "/dev/sdc": "tank",
+    }
+    assert calls == [("-j",)]
+    assert main._zpool_json_supported is True
+
+
+def test_get_zpool_device_map_json_unsupported_falls_back(monkeypatch):
+    monkeypatch.setattr(main, "ZPOOL_PATH", "/sbin/zpool")
+    monkeypatch.setattr(main, "_zpool_json_supported", None)
+    calls = []
+
+    def fake_status(*flags):
+        calls.append(flags)
+        if "-j" in flags:
+            return 2, ""
+        return 0, "  pool: tank\nconfig:\n    /dev/sdb ONLINE\n"
+
+    monkeypatch.setattr(main, "_run_zpool_status", fake_status)
+
+    assert main.get_zpool_device_map() == {"/dev/sdb": "tank"}
+    assert main._zpool_json_supported is False
+    # Later refreshes go straight to the text output
+    assert main.get_zpool_device_map() == {"/dev/sdb": "tank"}
+    assert [("-j" in c) for c in calls] == [True, False, False]
+
+
+def test_run_zpool_status_decodes_bytes(monkeypatch):
+    monkeypatch.setattr(main, "ZPOOL_PATH", "/sbin/zpool")
+    seen = {}
+
+    class FakeRun:
+        returncode = 0
+        stdout = "  pool: caf\u00e9\n".encode() + b"\xff\n"
+
+    def fake_run(cmd, **kw):
+        seen["cmd"], seen["kw"] = cmd, kw
+        return FakeRun()
+
+    monkeypatch.setattr(subprocess, "run", fake_run)
+
+    assert main._run_zpool_status("-j") == (0, "  pool: caf\u00e9\n\ufffd\n")
+    assert seen["cmd"] == ["/sbin/zpool", "status", "-j", "-PLp"]
+    assert "text" not in seen["kw"] and seen["kw"]["timeout"] == 5
+
+
+def test_get_zpool_device_map_logs_zpool_errors(monkeypatch):
+    monkeypatch.setattr(main, "ZPOOL_PATH", "/sbin/zpool")
+    monkeypatch.setattr(main, "_zpool_json_supported", False)
+
+    def hang(*flags):
+        raise subprocess.TimeoutExpired("zpool", 5)
+
+    monkeypatch.setattr(main, "_run_zpool_status", hang)
+    assert main.get_zpool_device_map() == {}
+
+
+def test_current_pool_map_falls_back_until_refreshed(monkeypatch):
+    monkeypatch.setattr(main, "_pool_map", None)
+    monkeypatch.setattr(main, "get_zpool_device_map", lambda: {"/dev/sda": "inline"})
+    assert asyncio.run(main.current_pool_map()) == {"/dev/sda": "inline"}
+
+    monkeypatch.setattr(main, "_pool_map", {"/dev/sda": "tank"})
+    assert asyncio.run(main.current_pool_map()) == {"/dev/sda": "tank"}
+
+
+def test_refresh_pool_map_forever_publishes_map(monkeypatch):
+    monkeypatch.setattr(main, "_pool_map", None)
+    monkeypatch.setattr(main, "_load_zpool_device_map", lambda: {"/dev/sdb": "backup"})
+
+    async def stop_after_first(_):
+        raise asyncio.CancelledError
+
+    monkeypatch.setattr(main.asyncio, "sleep", stop_after_first)
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(main.refresh_pool_map_forever())
+    assert main._pool_map == {"/dev/sdb": "backup"}
+
+
+def test_refresh_pool_map_forever_survives_errors(monkeypatch, caplog):
+    monkeypatch.setattr(main, "_pool_map", {"/dev/sda": "tank"})
+    results = iter([RuntimeError("boom"), {"/dev/sdb": "backup"}])
+
+    def flaky():
+        r = next(results)
+        if isinstance(r, Exception):
+            raise r
+        return r
+
+    published = []
+
+    async def record_then_stop(_):
+        published.append(main._pool_map)
+        if len(published) == 2:
+            raise asyncio.CancelledError
+
+    monkeypatch.setattr(main, "_load_zpool_device_map", flaky)
+    monkeypatch.setattr(main.asyncio, "sleep", record_then_stop)
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(main.refresh_pool_map_forever())
+    # The failed refresh kept the previous map, and the loop carried on
+    assert published == [{"/dev/sda": "tank"}, {"/dev/sdb": "backup"}]
+    assert any("pool map refresh failed" in rec.getMessage() for rec in caplog.records)
+
+
+def test_refresh_pool_map_forever_keeps_map_on_zpool_timeout(monkeypatch):
+    monkeypatch.setattr(main, "_pool_map", {"/dev/sda": "tank"})
+    monkeypatch.setattr(main, "ZPOOL_PATH", "/sbin/zpool")
+
+    def timeout(*flags):
+        raise subprocess.TimeoutExpired(["zpool", "status"], 5)
+
+    async def stop(_):
+        raise asyncio.CancelledError
+
+    monkeypatch.setattr(main, "_run_zpool_status", timeout)
+    monkeypatch.setattr(main.asyncio, "sleep", stop)
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(main.refresh_pool_map_forever())
+    # A zpool failure is not "no pools": the disks keep their pool label
+    assert main._pool_map == {"/dev/sda": "tank"}
+    # Direct callers still get an empty map
+    assert main.get_zpool_device_map() == {}
+
+
+@pytest.mark.parametrize(
+    "path, expected",
+    [
+        ("/dev/sdd1", "/dev/sdd"),
+        ("/dev/sdd", "/dev/sdd"),
+        ("/dev/sdaa12", "/dev/sdaa"),
+        ("/dev/nvme0n1p2", "/dev/nvme0n1"),
+        ("/dev/nvme0n1", "/dev/nvme0n1"),
+        ("/dev/mmcblk0p1", "/dev/mmcblk0"),
+        ("/dev/mmcblk0", "/dev/mmcblk0"),
+        ("/dev/nvme0n1p3", "/dev/nvme0n1"),
+        ("/dev/nvme10n12p13", "/dev/nvme10n12"),
+        ("/dev/disk/by-id/ata-DISK123-part1", "/dev/disk/by-id/ata-DISK123"),
+        ("/dev/disk/by-id/wwn-0x5000c500f7425581", "/dev/disk/by-id/wwn-0x5000c500f7425581"),
+        ("/dev/disk/by-id/wwn-0x5000c500f7425581-part9", "/dev/disk/by-id/wwn-0x5000c500f7425581"),
+    ],
+)
+def test_strip_partition(path, expected):
+    assert main._strip_partition(path) == expected